@@ -1,4 +1,8 @@
+import asyncio
 import logging
+from collections.abc import AsyncIterator
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
@@ -12,10 +16,25 @@ class Base(DeclarativeBase):
     pass
 
 
-def init_engine(database_url: str):
+def init_engine(
+    database_url: str,
+    pool_size: int = 20,
+    max_overflow: int = 30,
+    pool_timeout: int = 30,
+    pool_recycle: int = 1800,
+    pool_pre_ping: bool = True,
+):
     """Initialize the async SQLAlchemy engine and session factory."""
     global engine, async_session_factory
-    engine = create_async_engine(database_url, echo=False, pool_size=5, max_overflow=10)
+    engine = create_async_engine(
+        database_url,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+    )
     async_session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     logger.info("Database engine initialized")
 
@@ -27,12 +46,22 @@ async def create_tables():
     logger.info("Database tables created")
 
 
+async def warm_connection_pool(n: int):
+    """Open n pooled connections up front so early requests skip the connect handshake."""
+    async def _ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*[_ping() for _ in range(n)])
+    logger.info(f"Warmed {n} database connections")
+
+
 def get_session_factory():
     """Return the session factory (must be called after init_engine)."""
     return async_session_factory
 
 
-async def get_async_session() -> AsyncSession:
+async def get_async_session() -> AsyncIterator[AsyncSession]:
     """Dependency that yields an async DB session."""
     async with async_session_factory() as session:
         yield session
@@ -0,0 +1,19 @@
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from .services.atlassian_auth import AtlassianAuthService
+
+# auto_error=False so a missing token is a 401 (HTTPBearer itself raises 403)
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def get_current_session(
+    credentials: HTTPAuthorizationCredentials | None = Depends(bearer_scheme),
+) -> dict:
+    """Dependency that resolves the Bearer token to the caller's Atlassian session."""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    session = await AtlassianAuthService.get_session(credentials.credentials)
+    if not session:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return session
@@ -1,49 +1,77 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager, suppress
 
 from .config import get_settings
-from .database import init_engine, create_tables, dispose_engine
+from .database import init_engine, create_tables, dispose_engine, warm_connection_pool
 from .routers import auth, tickets, assignees
-
-settings = get_settings()
+from .services.atlassian_auth import AtlassianAuthService
+from .services.http_client import close_http_client, init_http_client
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    settings = get_settings()
     print(f"{settings.APP_NAME} v{settings.APP_VERSION} starting...")
-    init_engine(settings.DATABASE_URL)
+    init_engine(
+        settings.DATABASE_URL,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
     # Import models so they're registered with Base.metadata
     from . import models  # noqa: F401
     await create_tables()
+    await warm_connection_pool(settings.DB_POOL_SIZE)
     await assignees.seed_assignee_users()
     print("Database initialized")
+    init_http_client()
+    cleanup_task = asyncio.create_task(
+        AtlassianAuthService.run_periodic_cleanup(settings.SESSION_CLEANUP_INTERVAL_SECONDS)
+    )
     yield
+    cleanup_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await cleanup_task
+    await close_http_client()
     await dispose_engine()
     print(f"{settings.APP_NAME} shutting down...")
 
 
-app = FastAPI(
-    title=settings.APP_NAME,
-    version=settings.APP_VERSION,
-    lifespan=lifespan,
-)
+def create_app() -> FastAPI:
+    """Build the FastAPI app, reading settings once (override them before calling)."""
+    settings = get_settings()
+    app = FastAPI(
+        title=settings.APP_NAME,
+        version=settings.APP_VERSION,
+        lifespan=lifespan,
+        default_response_class=ORJSONResponse,
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "DELETE"],
+        allow_headers=["Authorization", "Content-Type"],
+        max_age=86400,  # let browsers cache preflight responses for a day
+    )
 
-app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
-app.include_router(tickets.router, prefix="/api/tickets", tags=["tickets"])
-app.include_router(assignees.router, prefix="/api/assignees", tags=["assignees"])
+    app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
+    app.include_router(tickets.router, prefix="/api/tickets", tags=["tickets"])
+    app.include_router(assignees.router, prefix="/api/assignees", tags=["assignees"])
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_api_route("/health", health, methods=["GET"])
+    return app
 
 
-@app.get("/")
 async def root():
+    settings = get_settings()
     return {
         "name": settings.APP_NAME,
         "version": settings.APP_VERSION,
@@ -51,6 +79,8 @@ async def root():
     }
 
 
-@app.get("/health")
 async def health():
     return {"status": "healthy"}
+
+
+app = create_app()
@@ -1,6 +1,8 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String, Text, func
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, Integer, String, Text, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import deferred
 
 from .database import Base
 
@@ -20,6 +22,16 @@ class AssigneeUser(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        # Serves list_users (active users ordered by name) without a sort
+        Index(
+            "ix_assignee_users_active_name",
+            "is_active",
+            "display_name",
+            postgresql_where=text("is_active = true"),
+        ),
+    )
+
 
 class ActivityLog(Base):
     """Audit trail for ticket actions."""
@@ -40,6 +52,12 @@ class ActivityLog(Base):
         index=True,
     )
 
+    __table_args__ = (
+        # Serves get_history's action filter in created_at order, so the
+        # newest matching rows are read without scanning or sorting the rest
+        Index("ix_activity_logs_action_created_at", "action", created_at.desc()),
+    )
+
 
 class Session(Base):
     """Persistent OAuth session store."""
@@ -48,8 +66,9 @@ class Session(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, unique=True, nullable=False, index=True)
     access_token = Column(Text, nullable=False)
-    refresh_token = Column(Text, nullable=True)
+    # Only read when refreshing; deferred so routine session loads skip it
+    refresh_token = deferred(Column(Text, nullable=True))
     cloud_id = Column(String, nullable=False)
     expires_at = Column(Float, nullable=False)
-    created_at = Column(Float, nullable=False)
-    user_info = Column(Text, nullable=False, default="{}")  # JSON string
+    created_at = Column(Float, nullable=False, index=True)
+    user_info = Column(JSONB, nullable=False, default=dict)
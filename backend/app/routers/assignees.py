@@ -1,9 +1,14 @@
+import asyncio
 import logging
 
-from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database import get_session_factory
+from ..config import get_settings
+from ..database import get_async_session, get_session_factory
+from ..dependencies import get_current_session
 from ..models import AssigneeUser
 from ..schemas.assignee import (
     AssigneeUserOut,
@@ -17,8 +22,7 @@ from ..schemas.assignee import (
     CurrentAssigneeItem,
     JiraSearchUserResult,
 )
-from ..services.atlassian_auth import AtlassianAuthService
-from ..services.audit import record_action
+from ..services.audit import record_action, record_actions
 from ..services.jira_cloud_service import JiraCloudService
 
 logger = logging.getLogger(__name__)
@@ -44,71 +48,68 @@ async def seed_assignee_users():
         if count_result.first() is not None:
             return  # already seeded
 
-        for display_name, username, email in SEED_USERS:
-            session.add(AssigneeUser(display_name=display_name, username=username, email=email))
+        # ON CONFLICT keeps this safe when several workers seed at the same time
+        rows = [
+            {"display_name": display_name, "username": username, "email": email}
+            for display_name, username, email in SEED_USERS
+        ]
+        await session.execute(
+            pg_insert(AssigneeUser)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=["username"])
+        )
         await session.commit()
         logger.info(f"Seeded {len(SEED_USERS)} assignee users")
 
 
-# ── Auth helper (same pattern as tickets router) ──────────────────────────────
-async def _get_session(request: Request) -> dict:
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    token = auth_header.replace("Bearer ", "")
-    session = await AtlassianAuthService.get_session(token)
-    if not session:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    return session
-
-
 # ── CRUD: Assignee Users ──────────────────────────────────────────────────────
 
-@router.get("/users", response_model=list[AssigneeUserOut])
-async def list_users(request: Request):
+@router.get(
+    "/users",
+    response_model=list[AssigneeUserOut],
+    dependencies=[Depends(get_current_session)],
+)
+async def list_users(session: AsyncSession = Depends(get_async_session)):
     """Return all active assignee users."""
-    await _get_session(request)
-    async with get_session_factory()() as session:
-        result = await session.execute(
-            select(AssigneeUser)
-            .where(AssigneeUser.is_active == True)
-            .order_by(AssigneeUser.display_name)
-        )
-        users = result.scalars().all()
-    return [
-        AssigneeUserOut(
-            id=u.id,
-            display_name=u.display_name,
-            username=u.username,
-            email=u.email,
-            is_active=u.is_active,
+    result = await session.execute(
+        select(
+            AssigneeUser.id,
+            AssigneeUser.display_name,
+            AssigneeUser.username,
+            AssigneeUser.email,
+            AssigneeUser.is_active,
         )
-        for u in users
-    ]
+        .where(AssigneeUser.is_active == True)
+        .order_by(AssigneeUser.display_name)
+    )
+    return [AssigneeUserOut.model_validate(row._mapping) for row in result]
 
 
 @router.post("/users", response_model=AssigneeUserOut, status_code=201)
-async def add_user(body: AssigneeUserCreate, request: Request):
+async def add_user(
+    body: AssigneeUserCreate,
+    background: BackgroundTasks,
+    session_data: dict = Depends(get_current_session),
+    session: AsyncSession = Depends(get_async_session),
+):
     """Add a new assignee user."""
-    session_data = await _get_session(request)
     user_info = session_data.get("user_info", {})
     actor_name = user_info.get("name", "Unknown")
     actor_email = user_info.get("email", "")
 
-    async with get_session_factory()() as session:
-        # Check for duplicate username
-        existing = await session.execute(
-            select(AssigneeUser).where(AssigneeUser.username == body.username)
-        )
-        if existing.scalar_one_or_none():
-            raise HTTPException(status_code=409, detail=f"User '{body.username}' already exists")
+    # Check for duplicate username
+    existing = await session.execute(
+        select(1).where(AssigneeUser.username == body.username).limit(1)
+    )
+    if existing.first() is not None:
+        raise HTTPException(status_code=409, detail=f"User '{body.username}' already exists")
 
-        user = AssigneeUser(display_name=body.display_name, username=body.username, email=body.email)
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
+    user = AssigneeUser(display_name=body.display_name, username=body.username, email=body.email)
+    session.add(user)
+    await session.commit()
 
-    await record_action(
+    background.add_task(
+        record_action,
         user_name=actor_name,
         user_email=actor_email,
         ticket_key="—",
@@ -125,26 +126,30 @@ async def add_user(body: AssigneeUserCreate, request: Request):
 
 
 @router.delete("/users/{user_id}", status_code=204)
-async def remove_user(user_id: int, request: Request):
+async def remove_user(
+    user_id: int,
+    background: BackgroundTasks,
+    session_data: dict = Depends(get_current_session),
+    session: AsyncSession = Depends(get_async_session),
+):
     """Remove an assignee user."""
-    session_data = await _get_session(request)
     user_info = session_data.get("user_info", {})
     actor_name = user_info.get("name", "Unknown")
     actor_email = user_info.get("email", "")
 
-    async with get_session_factory()() as session:
-        result = await session.execute(
-            select(AssigneeUser).where(AssigneeUser.id == user_id)
-        )
-        user = result.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        removed_name = user.display_name
-        removed_username = user.username
-        await session.delete(user)
-        await session.commit()
-
-    await record_action(
+    result = await session.execute(
+        delete(AssigneeUser)
+        .where(AssigneeUser.id == user_id)
+        .returning(AssigneeUser.display_name, AssigneeUser.username)
+    )
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
+    await session.commit()
+    removed_name, removed_username = row
+
+    background.add_task(
+        record_action,
         user_name=actor_name,
         user_email=actor_email,
         ticket_key="—",
@@ -156,9 +161,11 @@ async def remove_user(user_id: int, request: Request):
 # ── Search Jira users (live directory search) ─────────────────────────────────
 
 @router.get("/search-jira", response_model=list[JiraSearchUserResult])
-async def search_jira_users(query: str = Query(min_length=2), request: Request = None):
+async def search_jira_users(
+    query: str = Query(min_length=2),
+    session_data: dict = Depends(get_current_session),
+):
     """Search Jira user directory by name or email. Returns matching real users."""
-    session_data = await _get_session(request)
     cloud_id = session_data["cloud_id"]
     access_token = session_data["access_token"]
 
@@ -178,47 +185,69 @@ async def search_jira_users(query: str = Query(min_length=2), request: Request =
 # ── Look up current assignees ─────────────────────────────────────────────────
 
 @router.post("/current-assignees", response_model=CurrentAssigneeLookupResponse)
-async def get_current_assignees(body: CurrentAssigneeLookupRequest, request: Request):
+async def get_current_assignees(
+    body: CurrentAssigneeLookupRequest,
+    session_data: dict = Depends(get_current_session),
+):
     """Bulk-fetch the current assignee for a list of ticket keys."""
-    session_data = await _get_session(request)
     cloud_id = session_data["cloud_id"]
     access_token = session_data["access_token"]
+    sem = asyncio.Semaphore(get_settings().JIRA_MAX_CONCURRENCY)
+
+    # One JQL search covers the whole list; anything it can't answer falls
+    # back to a per-ticket lookup, which also reports that ticket's own error
+    try:
+        issues = await JiraCloudService.get_issues_bulk(
+            cloud_id, access_token, body.ticket_keys, fields="assignee"
+        )
+    except Exception as e:
+        logger.warning(f"Bulk assignee search failed, looking up tickets one by one: {e}")
+        issues = {}
 
-    results: list[CurrentAssigneeItem] = []
-    for ticket_key in body.ticket_keys:
+    async def fetch(ticket_key: str) -> CurrentAssigneeItem:
         try:
-            assignee = await JiraCloudService.get_issue_assignee(
-                cloud_id, access_token, ticket_key
-            )
-            if assignee:
-                results.append(CurrentAssigneeItem(
-                    ticket_key=ticket_key,
-                    display_name=assignee.get("displayName", ""),
-                    account_id=assignee.get("accountId", ""),
-                ))
+            issue = issues.get(ticket_key)
+            if issue is not None:
+                assignee = issue.get("fields", {}).get("assignee")
             else:
-                results.append(CurrentAssigneeItem(
-                    ticket_key=ticket_key,
-                    display_name="Unassigned",
-                    account_id="",
-                ))
+                async with sem:
+                    assignee = await JiraCloudService.get_issue_assignee(
+                        cloud_id, access_token, ticket_key
+                    )
         except Exception as e:
             logger.warning(f"Failed to get assignee for {ticket_key}: {e}")
-            results.append(CurrentAssigneeItem(
+            return CurrentAssigneeItem(
                 ticket_key=ticket_key,
                 display_name="Error",
                 account_id="",
                 error=str(e),
-            ))
+            )
+        if assignee:
+            return CurrentAssigneeItem(
+                ticket_key=ticket_key,
+                display_name=assignee.get("displayName", ""),
+                account_id=assignee.get("accountId", ""),
+            )
+        return CurrentAssigneeItem(
+            ticket_key=ticket_key,
+            display_name="Unassigned",
+            account_id="",
+        )
+
+    results = await asyncio.gather(*[fetch(key) for key in body.ticket_keys])
     return CurrentAssigneeLookupResponse(results=results)
 
 
 # ── Bulk assign ───────────────────────────────────────────────────────────────
 
 @router.post("/update", response_model=BulkAssigneeUpdateResponse)
-async def bulk_update_assignees(body: BulkAssigneeUpdateRequest, request: Request):
+async def bulk_update_assignees(
+    body: BulkAssigneeUpdateRequest,
+    background: BackgroundTasks,
+    session_data: dict = Depends(get_current_session),
+    session: AsyncSession = Depends(get_async_session),
+):
     """Bulk update assignees (and optionally add comments) on Jira tickets."""
-    session_data = await _get_session(request)
     cloud_id = session_data["cloud_id"]
     access_token = session_data["access_token"]
     user_info = session_data.get("user_info", {})
@@ -226,21 +255,37 @@ async def bulk_update_assignees(body: BulkAssigneeUpdateRequest, request: Reques
     user_email = user_info.get("email", "")
 
     is_bulk = len(body.tickets) > 1
+    sem = asyncio.Semaphore(get_settings().JIRA_MAX_CONCURRENCY)
 
-    # Pre-load emails from our DB as fallback (for users without direct accountId)
+    # Load emails from our DB as fallback, only for users without a direct accountId
+    needed = {t.assignee_username for t in body.tickets if not t.account_id}
     username_to_email: dict[str, str] = {}
-    async with get_session_factory()() as session:
-        all_users = await session.execute(
-            select(AssigneeUser).where(AssigneeUser.is_active == True)
+    if needed:
+        rows = await session.execute(
+            select(AssigneeUser.username, AssigneeUser.email)
+            .where(AssigneeUser.is_active == True)
+            .where(AssigneeUser.username.in_(needed))
         )
-        for u in all_users.scalars():
-            username_to_email[u.username] = u.email
+        username_to_email = {username: email for username, email in rows}
+        # End the read transaction so the pooled connection isn't held idle
+        # through the Jira calls below
+        await session.rollback()
+
+    # Resolve each distinct username once, concurrently, before touching any ticket
+    usernames = [u for u in needed if username_to_email.get(u)]
+
+    async def lookup(username: str) -> dict | None:
+        async with sem:
+            return await JiraCloudService.search_user(
+                cloud_id, access_token, username_to_email[username]
+            )
+
+    lookups = await asyncio.gather(*[lookup(u) for u in usernames], return_exceptions=True)
+    jira_users: dict[str, dict | None | BaseException] = dict(zip(usernames, lookups))
 
-    # Cache account-id lookups so we don't re-search the same username
-    account_id_cache: dict[str, str | None] = {}
+    audit_rows: list[dict] = []
 
-    results: list[AssigneeUpdateResult] = []
-    for ticket in body.tickets:
+    async def process(ticket: AssigneeTicketItem) -> AssigneeUpdateResult:
         try:
             username = ticket.assignee_username
 
@@ -249,21 +294,15 @@ async def bulk_update_assignees(body: BulkAssigneeUpdateRequest, request: Reques
                 account_id = ticket.account_id
             else:
                 # Fallback: resolve via email from local DB
-                email = username_to_email.get(username, "")
-                if not email:
+                if not username_to_email.get(username, ""):
                     raise ValueError(
                         f"No email configured for user '{username}'. Update the user's email in Manage Users."
                     )
 
-                if username not in account_id_cache:
-                    jira_user = await JiraCloudService.search_user(
-                        cloud_id, access_token, email
-                    )
-                    account_id_cache[username] = (
-                        jira_user.get("accountId") if jira_user else None
-                    )
-
-                account_id = account_id_cache[username]
+                jira_user = jira_users[username]
+                if isinstance(jira_user, BaseException):
+                    raise jira_user
+                account_id = jira_user.get("accountId") if jira_user else None
 
             if not account_id:
                 raise ValueError(
@@ -271,62 +310,63 @@ async def bulk_update_assignees(body: BulkAssigneeUpdateRequest, request: Reques
                 )
 
             # Assign the issue
-            await JiraCloudService.assign_issue(
-                cloud_id, access_token, ticket.ticket_key, account_id
-            )
+            async with sem:
+                await JiraCloudService.assign_issue(
+                    cloud_id, access_token, ticket.ticket_key, account_id
+                )
 
             # Audit
             detail_parts = [f"assignee={username}"]
             if is_bulk:
                 detail_parts.append("bulk=true")
-            await record_action(
+            audit_rows.append(dict(
                 user_name=user_name,
                 user_email=user_email,
                 ticket_key=ticket.ticket_key,
                 action="assignee_update",
                 label="",
                 details="; ".join(detail_parts),
-            )
+            ))
 
             # Optional comment
             comment_added = False
             if ticket.comment and ticket.comment.strip():
-                await JiraCloudService.add_issue_comment(
-                    cloud_id, access_token, ticket.ticket_key, ticket.comment
-                )
+                async with sem:
+                    await JiraCloudService.add_issue_comment(
+                        cloud_id, access_token, ticket.ticket_key, ticket.comment
+                    )
                 comment_added = True
-                await record_action(
+                audit_rows.append(dict(
                     user_name=user_name,
                     user_email=user_email,
                     ticket_key=ticket.ticket_key,
                     action="comment_added",
                     comment=ticket.comment,
-                )
+                ))
 
-            results.append(
-                AssigneeUpdateResult(
-                    ticket_key=ticket.ticket_key,
-                    success=True,
-                    assignee_set=username,
-                    comment_added=comment_added,
-                )
+            return AssigneeUpdateResult(
+                ticket_key=ticket.ticket_key,
+                success=True,
+                assignee_set=username,
+                comment_added=comment_added,
             )
 
         except Exception as e:
-            await record_action(
+            audit_rows.append(dict(
                 user_name=user_name,
                 user_email=user_email,
                 ticket_key=ticket.ticket_key,
                 action="assignee_failed",
                 details=f"assignee_update failed: {e}",
+            ))
+            return AssigneeUpdateResult(
+                ticket_key=ticket.ticket_key,
+                success=False,
+                error=str(e),
             )
-            results.append(
-                AssigneeUpdateResult(
-                    ticket_key=ticket.ticket_key,
-                    success=False,
-                    error=str(e),
-                )
-            )
+
+    results = await asyncio.gather(*[process(t) for t in body.tickets])
+    background.add_task(record_actions, audit_rows)
 
     successful = sum(1 for r in results if r.success)
     return BulkAssigneeUpdateResponse(
@@ -2,14 +2,14 @@ import logging
 import traceback
 from urllib.parse import quote_plus
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse
 
 from ..config import get_settings
+from ..dependencies import get_current_session
 from ..services.atlassian_auth import AtlassianAuthService
 
 logger = logging.getLogger(__name__)
-settings = get_settings()
 router = APIRouter()
 
 
@@ -23,6 +23,7 @@ async def atlassian_login():
 @router.get("/callback")
 async def atlassian_callback(code: str, state: str | None = None):
     """Handle Atlassian OAuth callback. Exchanges code for tokens and redirects to frontend."""
+    settings = get_settings()
     try:
         # Exchange authorization code for tokens
         logger.info("Exchanging code for tokens...")
@@ -87,18 +88,8 @@ async def atlassian_callback(code: str, state: str | None = None):
 
 
 @router.get("/me")
-async def get_current_user(request: Request):
+async def get_current_user(session: dict = Depends(get_current_session)):
     """Get current user information from the session."""
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    token = auth_header.replace("Bearer ", "")
-    session = await AtlassianAuthService.get_session(token)
-
-    if not session:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
     user_info = session["user_info"]
     return {
         "account_id": user_info.get("account_id", ""),
@@ -1,68 +1,81 @@
-import json
+import asyncio
 import logging
+from dataclasses import dataclass
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, Query, Request
+import orjson
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from ..config import get_settings
+from ..dependencies import get_current_session
 from ..schemas.ticket import (
     BulkLabelCheckResponse,
     BulkUpdateRequest,
     BulkUpdateResponse,
     DropdownConfig,
-    LabelCheckResult,
+    TicketLabelCheckItem,
     TicketLabelCheckRequest,
-    TicketUpdateResult,
+    TicketUpdate,
 )
-from ..services.atlassian_auth import AtlassianAuthService
-from ..services.audit import record_action, get_history
+from ..services.audit import record_actions, get_history, parse_cursor
 from ..services.jira_cloud_service import JiraCloudService
 
 logger = logging.getLogger(__name__)
-settings = get_settings()
 router = APIRouter()
 
+
+# Bulk endpoints build their rows as these slotted dataclasses rather than
+# pydantic models and hand them straight to orjson, which serializes
+# dataclasses natively. Fields mirror LabelCheckResult / TicketUpdateResult,
+# which stay as the response_model for the OpenAPI schema.
+@dataclass(slots=True)
+class _LabelCheckRow:
+    ticket_key: str
+    new_label: str
+    existing_results_labels: list[str]
+    has_conflict: bool
+
+
+@dataclass(slots=True)
+class _UpdateRow:
+    ticket_key: str
+    success: bool
+    label_applied: str | None = None
+    comment_added: bool = False
+    error: str | None = None
+
+
 # Load JSON config files
 DATA_DIR = Path(__file__).parent.parent / "data"
 
 
 def _load_json(filename: str) -> list:
-    with open(DATA_DIR / filename, "r") as f:
-        return json.load(f)
-
+    return orjson.loads((DATA_DIR / filename).read_bytes())
 
-async def _get_session(request: Request) -> dict:
-    """Extract and validate the session from the Authorization header."""
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
 
-    token = auth_header.replace("Bearer ", "")
-    session = await AtlassianAuthService.get_session(token)
-    if not session:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    return session
+# The config files don't change while the process runs, so parse them once
+_DROPDOWN_CONFIG = DropdownConfig(
+    stages=_load_json("stages.json"),
+    flows=_load_json("flows.json"),
+    results=_load_json("results.json"),
+)
 
 
 @router.get("/config", response_model=DropdownConfig)
 async def get_dropdown_config():
     """Return Stage, Flow, and Results dropdown options from JSON config files."""
-    return DropdownConfig(
-        stages=_load_json("stages.json"),
-        flows=_load_json("flows.json"),
-        results=_load_json("results.json"),
-    )
+    return _DROPDOWN_CONFIG
 
 
 @router.get("/{ticket_key}/labels")
-async def get_ticket_labels(ticket_key: str, request: Request):
+async def get_ticket_labels(ticket_key: str, session: dict = Depends(get_current_session)):
     """Get existing labels for a ticket, highlighting results_ prefixed ones."""
-    session = await _get_session(request)
     try:
         all_labels = await JiraCloudService.get_issue_labels(
             session["cloud_id"], session["access_token"], ticket_key
         )
-        results_labels = [l for l in all_labels if l.startswith("results_")]
+        results_labels = JiraCloudService.filter_results_labels(all_labels)
         return {
             "ticket_key": ticket_key,
             "labels": all_labels,
@@ -72,156 +85,327 @@ async def get_ticket_labels(ticket_key: str, request: Request):
         raise HTTPException(status_code=400, detail=f"Failed to get labels for {ticket_key}: {str(e)}")
 
 
-@router.post("/check-labels", response_model=BulkLabelCheckResponse)
-async def check_labels(body: TicketLabelCheckRequest, request: Request):
-    """Bulk check which tickets have the exact same label already applied."""
-    session = await _get_session(request)
-    results = []
-    for ticket in body.tickets:
-        try:
-            new_label = JiraCloudService.build_label(
-                ticket.stage, ticket.flow, ticket.result, ticket.failing_cmd or ""
-            )
-            results_labels = await JiraCloudService.get_results_labels(
-                session["cloud_id"], session["access_token"], ticket.ticket_key
-            )
-            # Only flag conflict when the exact new label already exists
-            results.append(LabelCheckResult(
-                ticket_key=ticket.ticket_key,
-                new_label=new_label,
-                existing_results_labels=results_labels,
-                has_conflict=new_label in results_labels,
-            ))
-        except Exception:
-            results.append(LabelCheckResult(
-                ticket_key=ticket.ticket_key,
-                new_label="",
-                existing_results_labels=[],
-                has_conflict=False,
-            ))
-    return BulkLabelCheckResponse(results=results)
+async def _check_ticket(
+    ticket: TicketLabelCheckItem,
+    sem: asyncio.Semaphore,
+    cloud_id: str,
+    access_token: str,
+    known_labels: dict[str, list[str]],
+) -> _LabelCheckRow:
+    """Check one ticket for an existing copy of the label it would receive.
+
+    Uses the ticket's results_ labels from the bulk search when present,
+    otherwise fetches them on its own.
+    """
+    try:
+        new_label = JiraCloudService.build_label(
+            ticket.stage, ticket.flow, ticket.result, ticket.failing_cmd or ""
+        )
+        results_labels = known_labels.get(ticket.ticket_key)
+        if results_labels is None:
+            async with sem:
+                results_labels = await JiraCloudService.get_results_labels(
+                    cloud_id, access_token, ticket.ticket_key
+                )
+        # Only flag conflict when the exact new label already exists
+        return _LabelCheckRow(
+            ticket_key=ticket.ticket_key,
+            new_label=new_label,
+            existing_results_labels=results_labels,
+            has_conflict=new_label in results_labels,
+        )
+    except Exception:
+        return _LabelCheckRow(
+            ticket_key=ticket.ticket_key,
+            new_label="",
+            existing_results_labels=[],
+            has_conflict=False,
+        )
 
 
-@router.post("/update", response_model=BulkUpdateResponse)
-async def bulk_update_tickets(body: BulkUpdateRequest, request: Request):
-    """Bulk update labels and add comments for multiple tickets."""
-    session = await _get_session(request)
+@router.post("/check-labels", response_model=BulkLabelCheckResponse)
+async def check_labels(body: TicketLabelCheckRequest, session: dict = Depends(get_current_session)):
+    """Bulk check which tickets have the exact same label already applied."""
     cloud_id = session["cloud_id"]
     access_token = session["access_token"]
-    user_info = session.get("user_info", {})
-    user_name = user_info.get("name", "Unknown")
-    user_email = user_info.get("email", "")
+    sem = asyncio.Semaphore(get_settings().JIRA_MAX_CONCURRENCY)
 
-    results = []
-    for ticket in body.tickets:
-        try:
-            # Skip tickets the user chose to skip (exact duplicate label)
-            if ticket.label_action == "skip":
-                results.append(TicketUpdateResult(
-                    ticket_key=ticket.ticket_key,
-                    success=True,
-                    label_applied=None,
-                    comment_added=False,
-                ))
-                continue
-
-            # Build the new label
-            new_label = JiraCloudService.build_label(
-                ticket.stage, ticket.flow, ticket.result, ticket.failing_cmd or ""
-            )
-            logger.info(
-                f"[{ticket.ticket_key}] Input: stage={ticket.stage!r}, flow={ticket.flow!r}, "
-                f"result={ticket.result!r}, failing_cmd={ticket.failing_cmd!r} => label={new_label!r}"
-            )
+    # One JQL search fetches every ticket's labels; tickets it doesn't
+    # return fall back to a per-ticket lookup
+    try:
+        known_labels = await JiraCloudService.get_results_labels_bulk(
+            cloud_id, access_token, [t.ticket_key for t in body.tickets]
+        )
+    except Exception as e:
+        logger.warning(f"Bulk label search failed, checking tickets one by one: {e}")
+        known_labels = {}
+
+    results = await asyncio.gather(*[
+        _check_ticket(ticket, sem, cloud_id, access_token, known_labels)
+        for ticket in body.tickets
+    ])
+    return ORJSONResponse({"results": results})
 
-            # Get current labels
-            current_labels = await JiraCloudService.get_issue_labels(
-                cloud_id, access_token, ticket.ticket_key
-            )
-            logger.info(f"[{ticket.ticket_key}] Current labels: {current_labels}")
 
-            # Always ADD new label alongside existing ones (keep old labels)
-            updated_labels = list(current_labels)
-            if new_label not in updated_labels:
-                updated_labels.append(new_label)
+def _skipped_result(ticket: TicketUpdate) -> _UpdateRow:
+    """Result for a ticket the user chose to skip (exact duplicate label)."""
+    return _UpdateRow(
+        ticket_key=ticket.ticket_key,
+        success=True,
+        label_applied=None,
+        comment_added=False,
+    )
 
-            logger.info(f"[{ticket.ticket_key}] Updating labels to: {updated_labels}")
 
-            # Update labels on the issue
-            await JiraCloudService.update_issue_labels(
-                cloud_id, access_token, ticket.ticket_key, updated_labels
-            )
+async def _process_ticket_group(
+    tickets: list[TicketUpdate],
+    sem: asyncio.Semaphore,
+    cloud_id: str,
+    access_token: str,
+    user_name: str,
+    user_email: str,
+    is_bulk: bool,
+    audit_rows: list[dict],
+) -> list[_UpdateRow]:
+    """Apply every update for one ticket key, collecting audit entries.
+
+    All rows share a single label write and a single comment (one paragraph
+    per row that has one). Returns one result per row, in input order.
+    Skipped rows never reach here; callers resolve them with _skipped_result.
+    """
+    ticket_key = tickets[0].ticket_key
+    new_labels = [
+        JiraCloudService.build_label(t.stage, t.flow, t.result, t.failing_cmd or "")
+        for t in tickets
+    ]
+    for ticket, new_label in zip(tickets, new_labels):
+        # Lazy %-args: nothing is formatted unless DEBUG is enabled
+        logger.debug(
+            "[%s] Input: stage=%r, flow=%r, result=%r, failing_cmd=%r => label=%r",
+            ticket_key, ticket.stage, ticket.flow, ticket.result, ticket.failing_cmd, new_label,
+        )
 
-            # Record audit: label update
-            details_parts = [f"action={ticket.label_action}"]
-            if ticket.failing_cmd:
-                details_parts.append(f"failing_cmd={ticket.failing_cmd}")
-            if is_bulk:
-                details_parts.append("bulk=true")
-            await record_action(
+    try:
+        # Always ADD new labels alongside existing ones (keep old labels);
+        # Jira merges them server-side, so the current labels are never fetched.
+        # Rows with the same stage/flow/result share a label; send it once.
+        async with sem:
+            await JiraCloudService.modify_issue_labels(
+                cloud_id, access_token, ticket_key, add=list(dict.fromkeys(new_labels))
+            )
+    except Exception as e:
+        for ticket in tickets:
+            audit_rows.append(dict(
                 user_name=user_name,
                 user_email=user_email,
-                ticket_key=ticket.ticket_key,
-                action="label_update",
-                label=new_label,
-                details="; ".join(details_parts),
-            )
+                ticket_key=ticket_key,
+                action="update_failed",
+                details=str(e),
+            ))
+        return [
+            _UpdateRow(ticket_key=ticket_key, success=False, error=str(e))
+            for _ in tickets
+        ]
 
-            # Add comment if provided
-            comment_added = False
-            if ticket.comment and ticket.comment.strip():
-                await JiraCloudService.add_issue_comment(
-                    cloud_id, access_token, ticket.ticket_key, ticket.comment
-                )
-                comment_added = True
-                await record_action(
-                    user_name=user_name,
-                    user_email=user_email,
-                    ticket_key=ticket.ticket_key,
-                    action="comment_added",
-                    comment=ticket.comment,
-                )
+    for ticket, new_label in zip(tickets, new_labels):
+        # Record audit: label update
+        details_parts = [f"action={ticket.label_action}"]
+        if ticket.failing_cmd:
+            details_parts.append(f"failing_cmd={ticket.failing_cmd}")
+        if is_bulk:
+            details_parts.append("bulk=true")
+        audit_rows.append(dict(
+            user_name=user_name,
+            user_email=user_email,
+            ticket_key=ticket_key,
+            action="label_update",
+            label=new_label,
+            details="; ".join(details_parts),
+        ))
 
-            results.append(TicketUpdateResult(
-                ticket_key=ticket.ticket_key,
-                success=True,
-                label_applied=new_label,
-                comment_added=comment_added,
-            ))
+    # Rows with a comment share one Jira comment, one paragraph each
+    comments = [t.comment for t in tickets if t.comment and t.comment.strip()]
+    comment_error: str | None = None
+    if comments:
+        try:
+            async with sem:
+                await JiraCloudService.add_issue_comments(
+                    cloud_id, access_token, ticket_key, comments
+                )
         except Exception as e:
-            await record_action(
+            comment_error = str(e)
+
+    results = []
+    for ticket, new_label in zip(tickets, new_labels):
+        has_comment = bool(ticket.comment and ticket.comment.strip())
+        if has_comment and comment_error is not None:
+            audit_rows.append(dict(
                 user_name=user_name,
                 user_email=user_email,
-                ticket_key=ticket.ticket_key,
+                ticket_key=ticket_key,
                 action="update_failed",
-                details=str(e),
-            )
-            results.append(TicketUpdateResult(
-                ticket_key=ticket.ticket_key,
+                details=comment_error,
+            ))
+            results.append(_UpdateRow(
+                ticket_key=ticket_key,
                 success=False,
-                error=str(e),
+                error=comment_error,
             ))
+            continue
+        if has_comment:
+            audit_rows.append(dict(
+                user_name=user_name,
+                user_email=user_email,
+                ticket_key=ticket_key,
+                action="comment_added",
+                comment=ticket.comment,
+            ))
+        results.append(_UpdateRow(
+            ticket_key=ticket_key,
+            success=True,
+            label_applied=new_label,
+            comment_added=has_comment,
+        ))
+    return results
+
+
+def _group_by_key(tickets: list[TicketUpdate]) -> dict[str, list[int]]:
+    """Map each ticket key to the indexes of its non-skipped rows, in input order."""
+    groups: dict[str, list[int]] = {}
+    for i, ticket in enumerate(tickets):
+        if ticket.label_action != "skip":
+            groups.setdefault(ticket.ticket_key, []).append(i)
+    return groups
+
+
+@router.post("/update", response_model=BulkUpdateResponse)
+async def bulk_update_tickets(
+    body: BulkUpdateRequest,
+    background: BackgroundTasks,
+    session: dict = Depends(get_current_session),
+):
+    """Bulk update labels and add comments for multiple tickets."""
+    cloud_id = session["cloud_id"]
+    access_token = session["access_token"]
+    user_info = session.get("user_info", {})
+    user_name = user_info.get("name", "Unknown")
+    user_email = user_info.get("email", "")
+
+    is_bulk = len(body.tickets) > 1
+    sem = asyncio.Semaphore(get_settings().JIRA_MAX_CONCURRENCY)
+
+    # Skips are answered in place; the rest is scheduled once per ticket key
+    # and written back into the same slots so results keep request order
+    results: list[_UpdateRow | None] = [
+        _skipped_result(t) if t.label_action == "skip" else None for t in body.tickets
+    ]
+    groups = list(_group_by_key(body.tickets).values())
+
+    audit_rows: list[dict] = []
+    done = await asyncio.gather(*[
+        _process_ticket_group(
+            [body.tickets[i] for i in group],
+            sem, cloud_id, access_token, user_name, user_email, is_bulk, audit_rows,
+        )
+        for group in groups
+    ])
+    for group, group_results in zip(groups, done):
+        for i, result in zip(group, group_results):
+            results[i] = result
+    background.add_task(record_actions, audit_rows)
 
     successful = sum(1 for r in results if r.success)
-    return BulkUpdateResponse(
-        results=results,
-        total=len(results),
-        successful=successful,
-        failed=len(results) - successful,
+    logger.info(
+        "Bulk update: %d tickets, %d ok, %d failed",
+        len(results), successful, len(results) - successful,
     )
+    return ORJSONResponse({
+        "results": results,
+        "total": len(results),
+        "successful": successful,
+        "failed": len(results) - successful,
+    })
+
 
+@router.post("/update/stream")
+async def bulk_update_tickets_stream(
+    body: BulkUpdateRequest,
+    background: BackgroundTasks,
+    session: dict = Depends(get_current_session),
+):
+    """Bulk update like /update, streaming each ticket's result as NDJSON when it finishes.
 
-@router.get("/history")
+    Lines arrive in completion order; the last line is a summary with
+    total/successful/failed counts.
+    """
+    cloud_id = session["cloud_id"]
+    access_token = session["access_token"]
+    user_info = session.get("user_info", {})
+    user_name = user_info.get("name", "Unknown")
+    user_email = user_info.get("email", "")
+
+    is_bulk = len(body.tickets) > 1
+    sem = asyncio.Semaphore(get_settings().JIRA_MAX_CONCURRENCY)
+    audit_rows: list[dict] = []
+    # Created here rather than in the generator so they stay referenced (and
+    # awaited by the audit flush) even if the client disconnects mid-stream
+    tasks = [
+        asyncio.create_task(_process_ticket_group(
+            [body.tickets[i] for i in group],
+            sem, cloud_id, access_token, user_name, user_email, is_bulk, audit_rows,
+        ))
+        for group in _group_by_key(body.tickets).values()
+    ]
+
+    async def stream():
+        successful = 0
+        # Skips are already known, so they go out first
+        for ticket in body.tickets:
+            if ticket.label_action == "skip":
+                successful += 1
+                yield orjson.dumps(_skipped_result(ticket)) + b"\n"
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                successful += result.success
+                yield orjson.dumps(result) + b"\n"
+        total = len(body.tickets)
+        yield orjson.dumps({
+            "total": total,
+            "successful": successful,
+            "failed": total - successful,
+        }) + b"\n"
+
+    async def record_when_done():
+        # Also runs when the client disconnects early; groups still in flight
+        # finish their Jira writes first so none of their audit rows are lost
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await record_actions(audit_rows)
+
+    background.add_task(record_when_done)
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.get("/history", dependencies=[Depends(get_current_session)])
 async def get_audit_history(
-    request: Request,
     limit: int = 200,
     offset: int = 0,
     actions: list[str] = Query(default=[]),
+    cursor: str | None = None,
 ):
-    """Get audit trail of ticket updates. Optionally filter by action types."""
-    await _get_session(request)
+    """Get audit trail of ticket updates. Optionally filter by action types.
+
+    Pass a response's next_cursor as `cursor` to fetch the following page
+    without OFFSET.
+    """
+    after = None
+    if cursor:
+        try:
+            after = parse_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
     return await get_history(
         limit=limit,
         offset=offset,
         actions=actions if actions else None,
+        after=after,
     )
@@ -1,121 +1,166 @@
-import json
+import asyncio
 import logging
 import secrets
 import time
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from urllib.parse import quote, urlencode
+from weakref import WeakValueDictionary
 
-import httpx
+from cachetools import TLRUCache, TTLCache
 from jose import jwt
 from sqlalchemy import select, delete
+from sqlalchemy.orm import undefer
 
 from ..config import get_settings
 from ..database import get_session_factory
 from ..models import Session
+from .http_client import get_http_client
 
-settings = get_settings()
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=4)
+def _authorize_url_prefix(
+    auth_url: str, client_id: str, scopes: str, backend_url: str
+) -> str:
+    """Authorize URL with every query parameter except the per-request state."""
+    query = urlencode(
+        {
+            "audience": "api.atlassian.com",
+            "client_id": client_id,
+            "scope": scopes,
+            "redirect_uri": f"{backend_url}/api/auth/callback",
+            "response_type": "code",
+        },
+        quote_via=quote,
+    )
+    return f"{auth_url}?{query}"
+
+
 class AtlassianAuthService:
     """Handles Atlassian Cloud OAuth 2.0 (3LO) authentication flow."""
 
+    # Per-worker cache of resolved sessions keyed by JWT; the TTL bounds staleness
+    _session_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+    _session_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+    # An access token's sites don't change during its (one hour) lifetime
+    _cloud_id_cache: TTLCache = TTLCache(maxsize=1024, ttl=1800)
+    # Verified JWT payloads, each kept until its own "exp" so an expired token
+    # is never served from here; tokens that fail verification are not stored
+    _jwt_cache: TLRUCache = TLRUCache(
+        maxsize=10_000,
+        ttu=lambda _token, payload, now: payload.get("exp", now),
+        timer=time.time,
+    )
+
+    @classmethod
+    def _decode_jwt(cls, jwt_token: str) -> dict:
+        """Verify and decode a session JWT, reusing the payload of tokens seen before."""
+        payload = cls._jwt_cache.get(jwt_token)
+        if payload is None:
+            settings = get_settings()
+            payload = jwt.decode(jwt_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            cls._jwt_cache[jwt_token] = payload
+        return payload
+
     @staticmethod
     def build_authorize_url() -> str:
         """Build the Atlassian OAuth 2.0 authorize URL."""
-        state = secrets.token_urlsafe(32)
-        callback_url = f"{settings.BACKEND_URL}/api/auth/callback"
-        scopes = settings.ATLASSIAN_SCOPES.replace(" ", "%20")
-        url = (
-            f"{settings.ATLASSIAN_AUTH_URL}"
-            f"?audience=api.atlassian.com"
-            f"&client_id={settings.ATLASSIAN_CLIENT_ID}"
-            f"&scope={scopes}"
-            f"&redirect_uri={callback_url}"
-            f"&state={state}"
-            f"&response_type=code"
+        settings = get_settings()
+        prefix = _authorize_url_prefix(
+            settings.ATLASSIAN_AUTH_URL,
+            settings.ATLASSIAN_CLIENT_ID,
+            settings.ATLASSIAN_SCOPES,
+            settings.BACKEND_URL,
         )
-        return url
+        state = secrets.token_urlsafe(32)
+        return f"{prefix}&state={state}"
 
     @staticmethod
     async def exchange_code_for_tokens(code: str) -> dict:
         """Exchange authorization code for access and refresh tokens."""
+        settings = get_settings()
         callback_url = f"{settings.BACKEND_URL}/api/auth/callback"
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                settings.ATLASSIAN_TOKEN_URL,
-                json={
-                    "grant_type": "authorization_code",
-                    "client_id": settings.ATLASSIAN_CLIENT_ID,
-                    "client_secret": settings.ATLASSIAN_CLIENT_SECRET,
-                    "code": code,
-                    "redirect_uri": callback_url,
-                },
-                headers={"Content-Type": "application/json"},
-            )
-            response.raise_for_status()
-            return response.json()
+        client = get_http_client()
+        response = await client.post(
+            settings.ATLASSIAN_TOKEN_URL,
+            json={
+                "grant_type": "authorization_code",
+                "client_id": settings.ATLASSIAN_CLIENT_ID,
+                "client_secret": settings.ATLASSIAN_CLIENT_SECRET,
+                "code": code,
+                "redirect_uri": callback_url,
+            },
+        )
+        response.raise_for_status()
+        return response.json()
 
     @staticmethod
     async def refresh_access_token(refresh_token: str) -> dict:
         """Refresh an expired access token using the refresh token."""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                settings.ATLASSIAN_TOKEN_URL,
-                json={
-                    "grant_type": "refresh_token",
-                    "client_id": settings.ATLASSIAN_CLIENT_ID,
-                    "client_secret": settings.ATLASSIAN_CLIENT_SECRET,
-                    "refresh_token": refresh_token,
-                },
-                headers={"Content-Type": "application/json"},
-            )
-            response.raise_for_status()
-            return response.json()
+        settings = get_settings()
+        client = get_http_client()
+        response = await client.post(
+            settings.ATLASSIAN_TOKEN_URL,
+            json={
+                "grant_type": "refresh_token",
+                "client_id": settings.ATLASSIAN_CLIENT_ID,
+                "client_secret": settings.ATLASSIAN_CLIENT_SECRET,
+                "refresh_token": refresh_token,
+            },
+        )
+        response.raise_for_status()
+        return response.json()
 
     @staticmethod
     async def get_accessible_resources(access_token: str) -> list:
         """Get list of accessible Atlassian Cloud sites for this token."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.atlassian.com/oauth/token/accessible-resources",
-                headers={"Authorization": f"Bearer {access_token}"},
-            )
-            response.raise_for_status()
-            return response.json()
+        client = get_http_client()
+        response = await client.get(
+            "https://api.atlassian.com/oauth/token/accessible-resources",
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        response.raise_for_status()
+        return response.json()
 
-    @staticmethod
-    async def get_cloud_id(access_token: str) -> str | None:
+    @classmethod
+    async def get_cloud_id(cls, access_token: str) -> str | None:
         """Extract the cloud ID for the amd.atlassian.net site."""
+        cloud_id = cls._cloud_id_cache.get(access_token)
+        if cloud_id is None:
+            cloud_id = await cls._fetch_cloud_id(access_token)
+            if cloud_id is not None:
+                cls._cloud_id_cache[access_token] = cloud_id
+        return cloud_id
+
+    @staticmethod
+    async def _fetch_cloud_id(access_token: str) -> str | None:
+        """Pick the cloud ID from the token's accessible resources (uncached)."""
         resources = await AtlassianAuthService.get_accessible_resources(access_token)
-        for resource in resources:
-            url = resource.get("url", "")
-            if "amd.atlassian.net" in url:
-                return resource["id"]
-        # If exact match not found, return first resource if available
-        if resources:
-            return resources[0]["id"]
-        return None
+        # Prefer the amd.atlassian.net site, else the first resource if any
+        return next(
+            (r["id"] for r in resources if "amd.atlassian.net" in r.get("url", "")),
+            resources[0]["id"] if resources else None,
+        )
 
     @staticmethod
     async def get_user_info(access_token: str, cloud_id: str) -> dict:
         """Get current user information from Jira Cloud API."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.atlassian.com/ex/jira/{cloud_id}/rest/api/3/myself",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Accept": "application/json",
-                },
-            )
-            response.raise_for_status()
-            data = response.json()
-            # Normalize to a consistent format
-            return {
-                "account_id": data.get("accountId", ""),
-                "name": data.get("displayName", ""),
-                "email": data.get("emailAddress", ""),
-                "picture": data.get("avatarUrls", {}).get("48x48", ""),
-            }
+        client = get_http_client()
+        response = await client.get(
+            f"https://api.atlassian.com/ex/jira/{cloud_id}/rest/api/3/myself",
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        response.raise_for_status()
+        data = response.json()
+        # Normalize to a consistent format
+        return {
+            "account_id": data.get("accountId", ""),
+            "name": data.get("displayName", ""),
+            "email": data.get("emailAddress", ""),
+            "picture": data.get("avatarUrls", {}).get("48x48", ""),
+        }
 
     @classmethod
     async def create_session(
@@ -134,15 +179,13 @@ class AtlassianAuthService:
                 cloud_id=cloud_id,
                 expires_at=expires_at,
                 created_at=time.time(),
-                user_info=json.dumps(user_info),
+                user_info=user_info,
             )
             db.add(db_session)
             await db.commit()
 
-        # Cleanup stale sessions (fire-and-forget)
-        await cls._cleanup_sessions()
-
         # Create a JWT that encodes the session_id
+        settings = get_settings()
         jwt_payload = {
             "sub": session_id,
             "exp": datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
@@ -153,8 +196,26 @@ class AtlassianAuthService:
     @classmethod
     async def get_session(cls, jwt_token: str) -> dict | None:
         """Look up a session by JWT token. Auto-refreshes if access token expired."""
+        cached = cls._session_cache.get(jwt_token)
+        if cached and time.time() < cached["expires_at"] - 60:
+            return cached
+
+        # Concurrent misses for the same token wait on one lookup instead of
+        # each hitting the database (and possibly refreshing) on their own
+        lock = cls._session_locks.get(jwt_token)
+        if lock is None:
+            lock = cls._session_locks[jwt_token] = asyncio.Lock()
+        async with lock:
+            cached = cls._session_cache.get(jwt_token)
+            if cached and time.time() < cached["expires_at"] - 60:
+                return cached
+            return await cls._load_session(jwt_token)
+
+    @classmethod
+    async def _load_session(cls, jwt_token: str) -> dict | None:
+        """Resolve a JWT to its stored session, refreshing the access token if needed."""
         try:
-            payload = jwt.decode(jwt_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            payload = cls._decode_jwt(jwt_token)
             session_id = payload.get("sub")
             if not session_id:
                 return None
@@ -168,6 +229,20 @@ class AtlassianAuthService:
                     return None
 
                 # Auto-refresh if access token is expired (with 60s margin)
+                if time.time() > db_session.expires_at - 60:
+                    # Lock the row so only one worker refreshes; the others
+                    # block here and then find the new token on the re-check
+                    result = await db.execute(
+                        select(Session)
+                        .where(Session.session_id == session_id)
+                        .options(undefer(Session.refresh_token))
+                        .with_for_update()
+                        .execution_options(populate_existing=True)
+                    )
+                    db_session = result.scalar_one_or_none()
+                    if not db_session:
+                        return None
+
                 if time.time() > db_session.expires_at - 60:
                     if db_session.refresh_token:
                         try:
@@ -183,22 +258,28 @@ class AtlassianAuthService:
                             await db.commit()
                             return None
 
-                return {
+                session = {
                     "access_token": db_session.access_token,
-                    "refresh_token": db_session.refresh_token,
                     "cloud_id": db_session.cloud_id,
                     "expires_at": db_session.expires_at,
                     "created_at": db_session.created_at,
-                    "user_info": json.loads(db_session.user_info),
+                    "user_info": db_session.user_info,
                 }
+                cls._session_cache[jwt_token] = session
+                return session
         except Exception:
             return None
 
     @classmethod
     async def invalidate_session(cls, jwt_token: str) -> bool:
         """Invalidate a session by removing it from the store."""
+        cls._session_cache.pop(jwt_token, None)
+        cls._jwt_cache.pop(jwt_token, None)
         try:
-            payload = jwt.decode(jwt_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            # Only the session_id is needed to delete the row, so the signature
+            # isn't verified: a forged token can only name a session_id the
+            # caller already knows, i.e. one whose bearer could log out anyway
+            payload = jwt.get_unverified_claims(jwt_token)
             session_id = payload.get("sub")
             if session_id:
                 async with get_session_factory()() as db:
@@ -214,7 +295,7 @@ class AtlassianAuthService:
     @classmethod
     async def _cleanup_sessions(cls):
         """Remove sessions older than JWT lifetime."""
-        max_age = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        max_age = get_settings().ACCESS_TOKEN_EXPIRE_MINUTES * 60
         cutoff = time.time() - max_age
         try:
             async with get_session_factory()() as db:
@@ -226,3 +307,10 @@ class AtlassianAuthService:
                 await db.commit()
         except Exception as e:
             logger.warning(f"Session cleanup failed: {e}")
+
+    @classmethod
+    async def run_periodic_cleanup(cls, interval: float):
+        """Remove stale sessions every `interval` seconds until cancelled (started at app startup)."""
+        while True:
+            await cls._cleanup_sessions()
+            await asyncio.sleep(interval)
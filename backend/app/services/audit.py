@@ -1,6 +1,7 @@
 import logging
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import select, func
+from sqlalchemy import insert, select, func, tuple_
 
 from ..database import get_session_factory
 from ..models import ActivityLog
@@ -33,25 +34,101 @@ async def record_action(
     logger.info(f"Audit: {user_name} -> {action} on {ticket_key} (label={label})")
 
 
-async def get_history(limit: int = 200, offset: int = 0, actions: list[str] | None = None) -> dict:
-    """Get audit log entries, newest first. Optionally filter by action types."""
+async def record_actions(entries: list[dict]):
+    """Record several audit trail entries to PostgreSQL in a single INSERT.
+
+    Each entry takes the same keys as record_action's arguments.
+    """
+    if not entries:
+        return
+    rows = [
+        {
+            "user_name": e["user_name"],
+            "user_email": e["user_email"],
+            "ticket_key": e["ticket_key"],
+            "action": e["action"],
+            "label": e.get("label", ""),
+            "comment": e.get("comment", ""),
+            "details": e.get("details", ""),
+        }
+        for e in entries
+    ]
     async with get_session_factory()() as session:
-        # Build base filter
-        count_query = select(func.count(ActivityLog.id))
-        data_query = select(ActivityLog).order_by(ActivityLog.created_at.desc())
+        await session.execute(insert(ActivityLog), rows)
+        await session.commit()
+    logger.info(f"Audit: recorded {len(rows)} entries")
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
 
-        if actions:
-            count_query = count_query.where(ActivityLog.action.in_(actions))
-            data_query = data_query.where(ActivityLog.action.in_(actions))
 
-        # Get total count
-        count_result = await session.execute(count_query)
-        total = count_result.scalar()
+def _make_cursor(log: ActivityLog) -> str:
+    """Encode a row's position as "<created_at epoch microseconds>_<id>" (URL-safe)."""
+    return f"{(log.created_at - _EPOCH) // _MICROSECOND}_{log.id}"
 
-        # Get paginated entries
-        data_query = data_query.offset(offset).limit(limit)
-        result = await session.execute(data_query)
-        logs = result.scalars().all()
+
+def parse_cursor(cursor: str) -> tuple[datetime, int]:
+    """Split a next_cursor value from _make_cursor; raises ValueError if malformed."""
+    micros, _, log_id = cursor.partition("_")
+    try:
+        return _EPOCH + int(micros) * _MICROSECOND, int(log_id)
+    except OverflowError as e:
+        raise ValueError(f"cursor out of range: {cursor}") from e
+
+
+async def get_history(
+    limit: int = 200,
+    offset: int = 0,
+    actions: list[str] | None = None,
+    after: tuple[datetime, int] | None = None,
+) -> dict:
+    """Get audit log entries, newest first. Optionally filter by action types.
+
+    Passing the previous page's next_cursor, decoded with parse_cursor, as
+    `after` seeks straight to the following page (keyset pagination) and
+    ignores `offset`, so deep pages cost the same as the first. Cursor pages
+    return total=None: an exact count would scan every matching row again on
+    each page, so callers keep the total from the first page.
+    """
+    filters = [ActivityLog.action.in_(actions)] if actions else []
+    # id breaks ties: a bulk update's entries share one transaction timestamp
+    order = (ActivityLog.created_at.desc(), ActivityLog.id.desc())
+    count_query = select(func.count(ActivityLog.id)).where(*filters)
+
+    async with get_session_factory()() as session:
+        if after is not None:
+            created_at, log_id = after
+            result = await session.execute(
+                select(ActivityLog)
+                .where(*filters)
+                .where(tuple_(ActivityLog.created_at, ActivityLog.id) < tuple_(created_at, log_id))
+                .order_by(*order)
+                .limit(limit)
+            )
+            logs = result.scalars().all()
+            total = None
+        else:
+            # COUNT(*) OVER () is computed over the filtered rows before
+            # OFFSET/LIMIT apply, so one query returns both the page and the total
+            result = await session.execute(
+                select(ActivityLog, func.count().over().label("total"))
+                .where(*filters)
+                .order_by(*order)
+                .offset(offset)
+                .limit(limit)
+            )
+            rows = result.all()
+            logs = [row.ActivityLog for row in rows]
+            if rows:
+                total = rows[0].total
+            elif offset == 0 and limit > 0:
+                # The first page of a real page size is empty only if nothing matches
+                total = 0
+            else:
+                # Paged past the end (or limit=0): no row carries the total,
+                # so count separately
+                total = (await session.execute(count_query)).scalar()
 
     entries = [
         {
@@ -67,4 +144,7 @@ async def get_history(limit: int = 200, offset: int = 0, actions: list[str] | No
         }
         for log in logs
     ]
-    return {"entries": entries, "total": total}
+    next_cursor = None
+    if logs and len(logs) == limit:
+        next_cursor = _make_cursor(logs[-1])
+    return {"entries": entries, "total": total, "next_cursor": next_cursor}
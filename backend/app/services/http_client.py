@@ -0,0 +1,41 @@
+import httpx
+
+# Shared across requests so Atlassian calls (OAuth and Jira) reuse pooled
+# keep-alive connections instead of a fresh TCP + TLS handshake per call
+_client: httpx.AsyncClient | None = None
+
+
+def init_http_client():
+    """Create the shared Atlassian HTTP client (called on app startup)."""
+    global _client
+    # HTTP/2 lets concurrent bulk calls share a few multiplexed connections
+    # to api.atlassian.com instead of one socket per in-flight request
+    _client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=64,
+            max_keepalive_connections=32,
+            keepalive_expiry=60.0,
+        ),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        # Every Atlassian endpoint speaks JSON; callers add only Authorization
+        headers={"Accept": "application/json", "Content-Type": "application/json"},
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared Atlassian HTTP client.
+
+    Created on first use when the app lifespan hasn't run (scripts, shells).
+    """
+    if _client is None or _client.is_closed:
+        init_http_client()
+    return _client
+
+
+async def close_http_client():
+    """Close the shared HTTP client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,35 +1,228 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Sequence
+from functools import lru_cache, partial
+from typing import TypeVar
+
 import httpx
+import orjson
+from cachetools import TTLCache
+
+from ..config import get_settings
+from .http_client import get_http_client
+from .ratelimit import RETRY_STATUSES, AsyncRateLimiter, with_retry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RESULTS_LABEL_PREFIX = "results_"
+_RESULTS_PREFIX_LEN = len(RESULTS_LABEL_PREFIX)
+
+# Jira caps a search page at 100 issues when fields are requested
+SEARCH_BATCH_SIZE = 100
+
+# Jira Cloud API v3 requires ADF (Atlassian Document Format) comment bodies.
+# The document and paragraph skeletons are serialized once and split around
+# their placeholders, so each comment only serializes its own text.
+_ADF_DOC_PREFIX, _ADF_DOC_SUFFIX = orjson.dumps(
+    {"body": {"type": "doc", "version": 1, "content": "__CONTENT__"}}
+).split(b'"__CONTENT__"')
+_ADF_PARAGRAPH_PREFIX, _ADF_PARAGRAPH_SUFFIX = orjson.dumps(
+    {"type": "paragraph", "content": [{"type": "text", "text": "__TEXT__"}]}
+).split(b'"__TEXT__"')
+
+# User directory results change rarely; bulk assigns resolve the same
+# people over and over. Keyed by (cloud_id, access_token, query, max_results):
+# what /user/search returns (and whether it includes emailAddress) depends on
+# the caller's permissions, so one user's results are never served to another.
+# Holds raw response bodies; each caller decodes its own copy.
+_user_search_cache: TTLCache = TTLCache(maxsize=1024, ttl=300)
+_user_search_inflight: dict[tuple, asyncio.Task] = {}
+
+# Stale-while-revalidate cache for get_issue. A hit younger than
+# ISSUE_FRESH_SECONDS is served as is; an older one (up to ISSUE_STALE_SECONDS)
+# is still served while a single background fetch replaces it. Views are
+# grouped per (cloud_id, issue_key) and keyed by (access_token, fields), so one
+# user's view is never served to another and a write drops them all at once.
+# Views hold the raw response body and every hit decodes its own copy, so a
+# caller mutating its result can't corrupt the cache for others.
+ISSUE_FRESH_SECONDS = 30
+ISSUE_STALE_SECONDS = 60
+_issue_cache: TTLCache = TTLCache(maxsize=10_000, ttl=ISSUE_STALE_SECONDS)
+_issue_refreshes: dict[tuple, asyncio.Task] = {}
+
+
+def _on_issue_refreshed(key: tuple, task: asyncio.Task):
+    _issue_refreshes.pop(key, None)
+    if not task.cancelled() and task.exception() is not None:
+        # The stale entry simply ages out; the next caller fetches in the foreground
+        logger.debug(f"Background refresh of {key[0][1]} failed: {task.exception()}")
+
+
+_limiter: AsyncRateLimiter | None = None
+
+
+def _get_limiter() -> AsyncRateLimiter:
+    """Return the process-wide Jira request rate limiter."""
+    global _limiter
+    if _limiter is None:
+        _limiter = AsyncRateLimiter(get_settings().JIRA_REQUESTS_PER_SECOND)
+    return _limiter
+
+
+async def _gather_bounded(
+    coros: list[Awaitable[T]], limit: int
+) -> list[T | BaseException]:
+    """Await coros concurrently with at most `limit` in flight, results in order.
+
+    A coroutine that raises yields its exception in place of a result, so one
+    failure doesn't discard the others.
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def run(coro: Awaitable[T]) -> T:
+        async with sem:
+            return await coro
+
+    return await asyncio.gather(*[run(coro) for coro in coros], return_exceptions=True)
+
+
+@lru_cache(maxsize=4096)
+def _build_label_cached(stage: str, flow: str, result: str, failing_cmd: str) -> str:
+    # Strip underscores from failing_cmd before evaluating
+    suffix = "" if failing_cmd and failing_cmd.replace("_", "").strip() else "_X"
+    return f"{RESULTS_LABEL_PREFIX}{stage}_{flow}_{result}{suffix}"
 
 
 class JiraCloudService:
     """Handles Jira Cloud REST API v3 interactions via api.atlassian.com."""
 
     @staticmethod
+    @lru_cache(maxsize=32)
     def _base_url(cloud_id: str) -> str:
         return f"https://api.atlassian.com/ex/jira/{cloud_id}/rest/api/3"
 
     @staticmethod
-    def _headers(access_token: str) -> dict:
-        return {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
+    async def _request(
+        method: str, url: str, access_token: str, idempotent: bool = True, **kwargs
+    ) -> httpx.Response:
+        """Send a rate-limited Jira request, retrying throttled and transient failures.
+
+        Non-idempotent requests (e.g. posting a comment) are only retried on 429,
+        where Jira guarantees the request was not processed.
+        """
+        client = get_http_client()
+        limiter = _get_limiter()
+
+        async def send() -> httpx.Response:
+            await limiter.acquire()
+            return await client.request(
+                method, url, headers={"Authorization": f"Bearer {access_token}"}, **kwargs
+            )
+
+        response = await with_retry(
+            send, retry_statuses=RETRY_STATUSES if idempotent else frozenset({429})
+        )
+        response.raise_for_status()
+        return response
 
     @staticmethod
     async def get_issue(cloud_id: str, access_token: str, issue_key: str, fields: str = "labels,summary,status") -> dict:
-        """Get a Jira issue with specified fields."""
+        """Get a Jira issue with specified fields (cached, stale-while-revalidate)."""
+        issue_id = (cloud_id, issue_key)
+        view = (access_token, fields)
+        entry = _issue_cache.get(issue_id, {}).get(view)
+        if entry is not None:
+            fetched_at, raw = entry
+            age = time.monotonic() - fetched_at
+            if age < ISSUE_STALE_SECONDS:
+                key = (issue_id, view)
+                if age >= ISSUE_FRESH_SECONDS and key not in _issue_refreshes:
+                    task = asyncio.create_task(
+                        JiraCloudService._fetch_issue(cloud_id, access_token, issue_key, fields)
+                    )
+                    _issue_refreshes[key] = task
+                    task.add_done_callback(partial(_on_issue_refreshed, key))
+                return orjson.loads(raw)
+        return await JiraCloudService._fetch_issue(cloud_id, access_token, issue_key, fields)
+
+    @staticmethod
+    async def _fetch_issue(cloud_id: str, access_token: str, issue_key: str, fields: str) -> dict:
+        """Fetch an issue from Jira and store it in the issue cache."""
+        issue_id = (cloud_id, issue_key)
+        views = _issue_cache.get(issue_id)
+        if views is None:
+            views = _issue_cache[issue_id] = {}
         url = f"{JiraCloudService._base_url(cloud_id)}/issue/{issue_key}"
         params = {"fields": fields}
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
+        response = await JiraCloudService._request(
+            "GET",
+            url,
+            access_token,
+            params=params,
+        )
+        raw = response.content
+        # Skip the store if a write invalidated the issue while this was in flight
+        if _issue_cache.get(issue_id) is views:
+            now = time.monotonic()
+            # Drop views past the stale window (e.g. a rotated access token's)
+            # so a hot issue's group doesn't accumulate them while it's renewed
+            expired = [
+                view for view, (fetched_at, _) in views.items()
+                if now - fetched_at >= ISSUE_STALE_SECONDS
+            ]
+            for view in expired:
+                del views[view]
+            views[(access_token, fields)] = (now, raw)
+            # Re-insert to restart the group's TTL; reads and in-place updates
+            # don't, and each view's own age is still checked in get_issue
+            _issue_cache[issue_id] = views
+        return orjson.loads(raw)
+
+    @staticmethod
+    def invalidate_issue(cloud_id: str, issue_key: str):
+        """Drop every cached view of an issue (after a write, or from a webhook)."""
+        _issue_cache.pop((cloud_id, issue_key), None)
+
+    @staticmethod
+    async def get_issues_bulk(
+        cloud_id: str, access_token: str, issue_keys: list[str], fields: str = "labels,summary,status"
+    ) -> dict[str, dict]:
+        """Get many Jira issues via JQL search, keyed by issue key.
+
+        One request per SEARCH_BATCH_SIZE keys instead of one per issue. Issues
+        the search does not return (unknown key, no permission, moved) are
+        simply absent, as are all keys of a batch Jira rejects outright (e.g. a
+        malformed key); the other batches' results are kept.
+        """
+        url = f"{JiraCloudService._base_url(cloud_id)}/search/jql"
+        keys = list(dict.fromkeys(issue_keys))
+        field_list = fields.split(",")
+
+        async def search(batch: list[str]) -> list[dict]:
+            jql = "key in ({})".format(",".join(f'"{key}"' for key in batch))
+            response = await JiraCloudService._request(
+                "POST",
                 url,
-                headers=JiraCloudService._headers(access_token),
-                params=params,
-                timeout=30.0,
+                access_token,
+                content=orjson.dumps({"jql": jql, "fields": field_list, "maxResults": len(batch)}),
             )
-            response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content).get("issues", [])
+
+        batches = [keys[i:i + SEARCH_BATCH_SIZE] for i in range(0, len(keys), SEARCH_BATCH_SIZE)]
+        pages = await _gather_bounded(
+            [search(batch) for batch in batches], get_settings().JIRA_MAX_CONCURRENCY
+        )
+        issues: dict[str, dict] = {}
+        for batch, page in zip(batches, pages):
+            if isinstance(page, BaseException):
+                logger.warning(f"Issue search failed for {len(batch)} keys: {page}")
+                continue
+            for issue in page:
+                issues[issue["key"]] = issue
+        return issues
 
     @staticmethod
     async def get_issue_assignee(cloud_id: str, access_token: str, issue_key: str) -> dict | None:
@@ -49,7 +242,28 @@ class JiraCloudService:
     async def get_results_labels(cloud_id: str, access_token: str, issue_key: str) -> list[str]:
         """Get only labels starting with 'results_' for a Jira issue."""
         labels = await JiraCloudService.get_issue_labels(cloud_id, access_token, issue_key)
-        return [label for label in labels if label.startswith("results_")]
+        return JiraCloudService.filter_results_labels(labels)
+
+    @staticmethod
+    async def get_results_labels_bulk(
+        cloud_id: str, access_token: str, issue_keys: list[str]
+    ) -> dict[str, list[str]]:
+        """Get 'results_' labels for many issues in one JQL search, keyed by issue key.
+
+        Same coverage as get_issues_bulk: issues the search doesn't return are absent.
+        """
+        issues = await JiraCloudService.get_issues_bulk(
+            cloud_id, access_token, issue_keys, fields="labels"
+        )
+        return {
+            key: JiraCloudService.filter_results_labels(issue.get("fields", {}).get("labels", []))
+            for key, issue in issues.items()
+        }
+
+    @staticmethod
+    def filter_results_labels(labels: list[str]) -> list[str]:
+        """Return the labels that start with 'results_'."""
+        return [label for label in labels if label[:_RESULTS_PREFIX_LEN] == RESULTS_LABEL_PREFIX]
 
     @staticmethod
     async def update_issue_labels(
@@ -57,50 +271,68 @@ class JiraCloudService:
     ) -> dict:
         """Replace all labels on a Jira issue."""
         url = f"{JiraCloudService._base_url(cloud_id)}/issue/{issue_key}"
-        async with httpx.AsyncClient() as client:
-            response = await client.put(
-                url,
-                headers=JiraCloudService._headers(access_token),
-                json={"fields": {"labels": labels}},
-                timeout=30.0,
-            )
-            response.raise_for_status()
-            # PUT returns 204 No Content on success
-            return {"status": "updated"}
+        await JiraCloudService._request(
+            "PUT",
+            url,
+            access_token,
+            content=orjson.dumps({"fields": {"labels": labels}}),
+        )
+        JiraCloudService.invalidate_issue(cloud_id, issue_key)
+        # PUT returns 204 No Content on success
+        return {"status": "updated"}
+
+    @staticmethod
+    async def modify_issue_labels(
+        cloud_id: str,
+        access_token: str,
+        issue_key: str,
+        add: Sequence[str] = (),
+        remove: Sequence[str] = (),
+    ) -> dict:
+        """Add and/or remove labels on a Jira issue, leaving its other labels alone.
+
+        Uses the issue edit "update" verb so Jira applies the changes server-side;
+        no prior read of the current labels is needed.
+        """
+        url = f"{JiraCloudService._base_url(cloud_id)}/issue/{issue_key}"
+        operations = [{"add": label} for label in add] + [{"remove": label} for label in remove]
+        await JiraCloudService._request(
+            "PUT",
+            url,
+            access_token,
+            content=orjson.dumps({"update": {"labels": operations}}),
+        )
+        JiraCloudService.invalidate_issue(cloud_id, issue_key)
+        # PUT returns 204 No Content on success
+        return {"status": "updated"}
 
     @staticmethod
     async def add_issue_comment(
         cloud_id: str, access_token: str, issue_key: str, comment_body: str
     ) -> dict:
         """Add a comment to a Jira issue using Atlassian Document Format (ADF)."""
+        return await JiraCloudService.add_issue_comments(
+            cloud_id, access_token, issue_key, [comment_body]
+        )
+
+    @staticmethod
+    async def add_issue_comments(
+        cloud_id: str, access_token: str, issue_key: str, comment_bodies: list[str]
+    ) -> dict:
+        """Add one comment to a Jira issue with a paragraph per entry of comment_bodies."""
         url = f"{JiraCloudService._base_url(cloud_id)}/issue/{issue_key}/comment"
-        # Jira Cloud API v3 requires ADF format for comments
-        adf_body = {
-            "body": {
-                "type": "doc",
-                "version": 1,
-                "content": [
-                    {
-                        "type": "paragraph",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": comment_body,
-                            }
-                        ],
-                    }
-                ],
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers=JiraCloudService._headers(access_token),
-                json=adf_body,
-                timeout=30.0,
-            )
-            response.raise_for_status()
-            return response.json()
+        paragraphs = b",".join(
+            _ADF_PARAGRAPH_PREFIX + orjson.dumps(text) + _ADF_PARAGRAPH_SUFFIX
+            for text in comment_bodies
+        )
+        response = await JiraCloudService._request(
+            "POST",
+            url,
+            access_token,
+            content=_ADF_DOC_PREFIX + b"[" + paragraphs + b"]" + _ADF_DOC_SUFFIX,
+            idempotent=False,
+        )
+        return orjson.loads(response.content)
 
     @staticmethod
     def build_label(stage: str, flow: str, result: str, failing_cmd: str) -> str:
@@ -110,43 +342,56 @@ class JiraCloudService:
         If failing_cmd is empty (after stripping underscores), append '_X'.
         Example: results_S1_F2_R3 or results_S1_F2_R3_X
         """
-        # Strip underscores from failing_cmd before evaluating
-        failing_cmd_clean = failing_cmd.replace("_", "").strip() if failing_cmd else ""
-        label = f"results_{stage}_{flow}_{result}"
-        if not failing_cmd_clean:
-            label += "_X"
-        return label
+        return _build_label_cached(stage, flow, result, failing_cmd)
 
     @staticmethod
     async def search_user(cloud_id: str, access_token: str, query: str) -> dict | None:
         """Search for a Jira user by username/email query and return the first match."""
-        url = f"{JiraCloudService._base_url(cloud_id)}/user/search"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url,
-                headers=JiraCloudService._headers(access_token),
-                params={"query": query, "maxResults": 5},
-                timeout=30.0,
-            )
-            response.raise_for_status()
-            users = response.json()
-            if users:
-                return users[0]
-            return None
+        users = await JiraCloudService.search_users(cloud_id, access_token, query, max_results=1)
+        return users[0] if users else None
 
     @staticmethod
     async def search_users(cloud_id: str, access_token: str, query: str, max_results: int = 10) -> list[dict]:
         """Search for Jira users matching query. Returns all matching users."""
-        url = f"{JiraCloudService._base_url(cloud_id)}/user/search"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url,
-                headers=JiraCloudService._headers(access_token),
-                params={"query": query, "maxResults": max_results},
-                timeout=30.0,
-            )
-            response.raise_for_status()
-            return response.json()
+        return await JiraCloudService._search_users_cached(
+            cloud_id, access_token, query, max_results
+        )
+
+    @staticmethod
+    async def _search_users_cached(
+        cloud_id: str, access_token: str, query: str, max_results: int
+    ) -> list[dict]:
+        """User search through a short-lived per-caller cache.
+
+        Concurrent misses for the same caller and query share one request.
+        Failed and empty searches are not cached (Jira answers a caller without
+        Browse users permission with an empty list rather than an error).
+        """
+        key = (cloud_id, access_token, query, max_results)
+        raw = _user_search_cache.get(key)
+        if raw is not None:
+            return orjson.loads(raw)
+
+        task = _user_search_inflight.get(key)
+        if task is None:
+            async def fetch() -> bytes:
+                url = f"{JiraCloudService._base_url(cloud_id)}/user/search"
+                response = await JiraCloudService._request(
+                    "GET",
+                    url,
+                    access_token,
+                    params={"query": query, "maxResults": max_results},
+                )
+                raw = response.content
+                if orjson.loads(raw):
+                    _user_search_cache[key] = raw
+                return raw
+
+            task = _user_search_inflight[key] = asyncio.create_task(fetch())
+            task.add_done_callback(lambda _: _user_search_inflight.pop(key, None))
+        # Shielded so one cancelled caller doesn't cancel the others' request;
+        # the shared result is bytes, so each waiter decodes its own list
+        return orjson.loads(await asyncio.shield(task))
 
     @staticmethod
     async def assign_issue(
@@ -154,13 +399,12 @@ class JiraCloudService:
     ) -> dict:
         """Assign an issue to a user by their accountId."""
         url = f"{JiraCloudService._base_url(cloud_id)}/issue/{issue_key}/assignee"
-        async with httpx.AsyncClient() as client:
-            response = await client.put(
-                url,
-                headers=JiraCloudService._headers(access_token),
-                json={"accountId": account_id},
-                timeout=30.0,
-            )
-            response.raise_for_status()
-            return {"status": "assigned"}
+        await JiraCloudService._request(
+            "PUT",
+            url,
+            access_token,
+            content=orjson.dumps({"accountId": account_id}),
+        )
+        JiraCloudService.invalidate_issue(cloud_id, issue_key)
+        return {"status": "assigned"}
 
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Throttled or transiently unavailable; safe to retry for idempotent requests
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+class AsyncRateLimiter:
+    """Token bucket allowing `rate` acquisitions per second, bursting up to `burst`."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available, then take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Return the Retry-After delay in seconds, if the server sent a numeric one."""
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def with_retry(
+    func: Callable[[], Awaitable[httpx.Response]],
+    max_attempts: int = 5,
+    base: float = 0.5,
+    max_delay: float = 10.0,
+    retry_statuses: frozenset[int] = RETRY_STATUSES,
+) -> httpx.Response:
+    """Call func until it returns a non-retryable response or attempts run out.
+
+    Waits for the server's Retry-After when given, otherwise backs off
+    exponentially from `base` with full jitter so concurrent callers don't
+    retry in lockstep. Failures to connect are retried the same way, since
+    nothing was sent. The final response is returned unchanged so the
+    caller can raise_for_status() on it.
+    """
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        try:
+            response = await func()
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            if last_attempt:
+                raise
+            delay = random.uniform(0, min(max_delay, base * 2 ** attempt))
+            logger.warning(f"Connection failed ({e!r}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        if response.status_code not in retry_statuses or last_attempt:
+            return response
+        delay = _retry_after(response)
+        if delay is None:
+            delay = random.uniform(0, base * 2 ** attempt)
+        delay = min(max_delay, delay)
+        logger.warning(
+            f"{response.request.method} {response.request.url.path} returned "
+            f"{response.status_code}; retrying in {delay:.2f}s"
+        )
+        await asyncio.sleep(delay)
+    return response